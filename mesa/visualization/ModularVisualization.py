@@ -54,12 +54,42 @@ Server -> Client:
 
     {
     "type": "viz_state",
+    "frame": number of this message, counting from 1,
     "data": [{0:[ {"Shape": "circle", "x": 0, "y": 0, "r": 0.5,
                 "Color": "#AAAAAA", "Filled": "true", "Layer": 0,
                 "text": 'A', "text_color": "white" }]},
             "Shape Count: 1"]
     }
 
+    The following applies only to elements with a true "server_protocol"
+    attribute, which are also given the number of each message as their
+    "frame" attribute before it is rendered.
+
+    Elements with a true "binary" attribute send their state in a binary
+    frame ahead of the viz_state message, whose data holds {"binary": true}
+    in their place. The frame starts with the element index as a
+    little-endian uint32, followed by the bytes from element.render_binary.
+
+    Elements with a "stream_batch" attribute other than None send their
+    state in batches ahead of the viz_state message, whose data holds
+    {"stream": true} in their place.
+    {
+    "type": "grid_state_partial",
+    "index": index of the element,
+    "batch_id": 0, 1, ...,
+    "start", "end": range of the portrayals in this batch,
+    "done": whether this is the last batch,
+    "data": [portrayals]
+    }
+
+    Text for the tooltip of a cell, in answer to "get_tooltip"
+    {
+    "type": "tooltip",
+    "index": index of the element,
+    "x", "y": the cell,
+    "data": [{"Layer": ..., "text": ..., "text_color": ...}, ...]
+    }
+
     Informs the client that the model is over.
     {"type": "end"}
 
@@ -93,10 +123,35 @@ Client -> Server:
     {
     "type": "get_params"
     }
+
+    The last three messages are only handled for elements with a true
+    "server_protocol" attribute.
+
+    Restrict the cells rendered by an element that supports a viewport
+    {
+    "type": "set_viewport",
+    "index": index of the element,
+    "viewport": [x0, y0, x1, y1], or null for the whole grid
+    }
+
+    Report that an element has finished drawing a viz_state message
+    {
+    "type": "ack",
+    "index": index of the element,
+    "frame": the "frame" of the message that was drawn
+    }
+
+    Get the text for the tooltip of a cell from an element that supports it
+    {
+    "type": "get_tooltip",
+    "index": index of the element,
+    "x", "y": the cell
+    }
 """
 import asyncio
 import os
 import platform
+import struct
 import webbrowser
 
 import tornado.autoreload
@@ -141,6 +196,11 @@ class VisualizationElement:
                    directory where the server is being run. If an absolute path
                    is given, it is used as-is. Default is the current working
                    directory.
+        server_protocol: Whether the element takes part in the "frame",
+                         "set_viewport", "ack" and "get_tooltip" exchanges and
+                         may send its state in binary or streamed form (see
+                         the module docstring). Other elements are only sent
+                         the output of render.
 
     Methods:
         render: Takes a model object, and produces JSON data which can be sent
@@ -152,6 +212,7 @@ class VisualizationElement:
     js_code = ""
     render_args = {}
     local_dir = ""
+    server_protocol = False
 
     def __init__(self):
         pass
@@ -214,11 +275,58 @@ class SocketHandler(tornado.websocket.WebSocketHandler):
     def check_origin(self, origin):
         return True
 
+    def get_compression_options(self):
+        return self.application.websocket_compression
+
     @property
     def viz_state_message(self):
-        return {"type": "viz_state", "data": self.application.render_model()}
+        return (
+            '{"type": "viz_state", "frame": '
+            + str(self.application.frame)
+            + ', "data": '
+            + self.application.render_model_json()
+            + "}"
+        )
 
-    def on_message(self, message):
+    async def write_viz_state(self):
+        """Send the model state, preceded by the frames of binary elements and
+        the batches of streaming elements."""
+        model = self.application.model
+        self.application.frame += 1
+        for index, element in enumerate(self.application.visualization_elements):
+            if not getattr(element, "server_protocol", False):
+                continue
+            element.frame = self.application.frame
+            if element.binary:
+                payload = element.render_binary(model)
+                if payload is not None:
+                    self.write_message(struct.pack("<I", index) + payload, binary=True)
+            elif element.stream_batch is not None:
+                await self.write_stream(index, element.render_stream(model))
+        self.write_message(self.viz_state_message)
+
+    async def write_stream(self, index, batches):
+        batch_id = 0
+        pending = None
+        async for start, data in batches:
+            if pending is not None:
+                self.write_message(pending)
+            pending = {
+                "type": "grid_state_partial",
+                "index": index,
+                "batch_id": batch_id,
+                "start": start,
+                "end": start + len(data),
+                "done": False,
+                "data": data,
+            }
+            batch_id += 1
+        # Hold each batch back by one, so that the last one can be flagged as such.
+        if pending is not None:
+            pending["done"] = True
+            self.write_message(pending)
+
+    async def on_message(self, message):
         """Receiving a message from the websocket, parse, and act accordingly."""
         if self.application.verbose:
             print(message)
@@ -229,11 +337,11 @@ class SocketHandler(tornado.websocket.WebSocketHandler):
                 self.write_message({"type": "end"})
             else:
                 self.application.model.step()
-                self.write_message(self.viz_state_message)
+                await self.write_viz_state()
 
         elif msg["type"] == "reset":
             self.application.reset_model()
-            self.write_message(self.viz_state_message)
+            await self.write_viz_state()
 
         elif msg["type"] == "submit_params":
             param = msg["param"]
@@ -246,6 +354,31 @@ class SocketHandler(tornado.websocket.WebSocketHandler):
                 else:
                     self.application.model_kwargs[param] = value
 
+        elif msg["type"] == "set_viewport":
+            element = self.application.visualization_elements[msg["index"]]
+            if getattr(element, "server_protocol", False):
+                viewport = msg["viewport"]
+                element.viewport = tuple(viewport) if viewport is not None else None
+
+        elif msg["type"] == "ack":
+            element = self.application.visualization_elements[msg["index"]]
+            if getattr(element, "server_protocol", False):
+                element.ack(msg["frame"])
+
+        elif msg["type"] == "get_tooltip":
+            element = self.application.visualization_elements[msg["index"]]
+            if getattr(element, "server_protocol", False):
+                data = element.get_tooltip(self.application.model, msg["x"], msg["y"])
+                self.write_message(
+                    {
+                        "type": "tooltip",
+                        "index": msg["index"],
+                        "x": msg["x"],
+                        "y": msg["y"],
+                        "data": data,
+                    }
+                )
+
         else:
             if self.application.verbose:
                 print("Unexpected message!")
@@ -280,6 +413,14 @@ class ModularServer(tornado.web.Application):
 
         self.verbose = True
         self.max_steps = 100000
+        # Options for the permessage-deflate compression of websocket messages
+        # (see tornado.websocket.WebSocketHandler.get_compression_options), or
+        # None to disable it. The portrayals of large grids are very repetitive,
+        # and the fastest level already shrinks them 10-20 times.
+        self.websocket_compression = {"compression_level": 1}
+        # Number of viz_state messages sent, which tags each of them so that
+        # elements can tell how far behind the client is (see the "ack" message).
+        self.frame = 0
 
         if port is not None:
             self.port = port
@@ -394,6 +535,21 @@ class ModularServer(tornado.web.Application):
             visualization_state.append(element_state)
         return visualization_state
 
+    def render_model_json(self):
+        """Serialize the current state of the model to a JSON array string.
+
+        Elements which define a render_json method serialize their own state,
+        so that their output does not have to be encoded a second time here.
+        """
+        fragments = []
+        for element in self.visualization_elements:
+            render_json = getattr(element, "render_json", None)
+            if render_json is not None:
+                fragments.append(render_json(self.model))
+            else:
+                fragments.append(tornado.escape.json_encode(element.render(self.model)))
+        return "[" + ",".join(fragments) + "]"
+
     def launch(self, port=None, open_browser=True):
         """Run the app."""
         if port is not None:
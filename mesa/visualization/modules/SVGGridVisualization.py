@@ -1,80 +1,80 @@
 # SVGGridModule and -Visualization for Mesa
-# 
+#
 # Modified MIT License:
 # Copyright (c) 2023 David Burgess, University of Saskatchewan
-# 
-# Permission is hereby granted, free of charge, to any person obtaining a copy of this software 
-# and associated documentation files (the 'Software'), to deal in the Software without restriction, 
-# including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, 
-# and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, 
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+# and associated documentation files (the 'Software'), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
 # subject to the following conditions:
-# 
-# The above copyright notice and this permission notice shall be included in all copies or substantial 
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial
 # portions of the Software.
-# 
-# Any academic work (publication or presentation) or commercial usage resulting from the use of this 
+#
+# Any academic work (publication or presentation) or commercial usage resulting from the use of this
 # Software must include a citation analogous to the following:
-# 
+#
 # AMA:
-# Burgess, D. SVGGridModule and -Visualization for Mesa [Computer software]. Version 1.0. Saskatoon, 
+# Burgess, D. SVGGridModule and -Visualization for Mesa [Computer software]. Version 1.0. Saskatoon,
 # Canada: University of Saskatchewan; 2023.
-# 
+#
 # APA:
-# Burgess, D. (2023). SVGGridModule and -Visualization for Mesa (1.0) [Computer software]. University 
+# Burgess, D. (2023). SVGGridModule and -Visualization for Mesa (1.0) [Computer software]. University
 # of Saskatchewan. http://davidburgess.ca/mesa/mesasvg/
-# 
+#
 # Chicago:
 # Burgess, David. SVGGridModule and -Visualization for Mesa. V. 1.0. University of Saskatchewan. Python. 2023.
-# 
+#
 # Harvard:
-# Burgess, D. (2023) SVGGridModule and -Visualization for Mesa (Version 1.0) [Computer program]. University 
+# Burgess, D. (2023) SVGGridModule and -Visualization for Mesa (Version 1.0) [Computer program]. University
 # of Saskatchewan, Saskatoon, Canada.
-# 
+#
 # MLA:
-# Burgess, David. SVGGridModule and -Visualization for Mesa. Version 1.0, University of Saskatchewan, 
+# Burgess, David. SVGGridModule and -Visualization for Mesa. Version 1.0, University of Saskatchewan,
 # 13 May 2023.
-# 
-# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT 
-# LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. 
-# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, 
-# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE 
+#
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+# LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
 # OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
-# 
-# 
+#
+#
 # VERSION 1.0
-# 
-# 
+#
+#
 # BASIC USAGE GUIDE
-# 
+#
 # This file is used in conjunction with the Mesa package for Python for the purpose of providing a visualization
-# for Agent-Based Models constructed using Mesa.  The file is used as any other Mesa Visualization Module would be.  
+# for Agent-Based Models constructed using Mesa.  The file is used as any other Mesa Visualization Module would be.
 # It replicates, with some additional features, the functionality of CanvasModule.js and GridDraw.js but replaces
-# the use of bitmap images within an HTML5 Canvas environment for vector images within an SVG (scalable vector 
+# the use of bitmap images within an HTML5 Canvas environment for vector images within an SVG (scalable vector
 # graphics) environment.
-# 
-# This file, in conjunction with the required SVGGridModule.js file, is a part of a complex data visualization 
-# tool, which creates interactive, grid-based visualizations using the D3.js library. It is designed to represent 
-# multi-dimensional data on a two-dimensional grid, allowing the user to visualize data where each grid cell can 
-# have multiple attributes that are represented by different shapes, colors, sizes, and text. Depending on the 'Shape' 
-# attribute of each data point, the script dynamically renders SVG elements including squares, circles, triangles, 
-# as well as custom SVG files. These SVG elements are then stylized and positioned according to data attributes 
+#
+# This file, in conjunction with the required SVGGridModule.js file, is a part of a complex data visualization
+# tool, which creates interactive, grid-based visualizations using the D3.js library. It is designed to represent
+# multi-dimensional data on a two-dimensional grid, allowing the user to visualize data where each grid cell can
+# have multiple attributes that are represented by different shapes, colors, sizes, and text. Depending on the 'Shape'
+# attribute of each data point, the script dynamically renders SVG elements including squares, circles, triangles,
+# as well as custom SVG files. These SVG elements are then stylized and positioned according to data attributes
 # like 'Color', 'scale', 'Layer', and 'text' -- be mindful of capitalization idiosyncrasies.
-# 
-# The visualization contains additional interactivity: 
-# 1) When a user hovers over a cell in the grid, a tooltip appears displaying detailed information about that specific 
-#    data point, enhancing the user's understanding of the data. The tooltip information includes the cell's position 
-#    and layered data attributes. 
+#
+# The visualization contains additional interactivity:
+# 1) When a user hovers over a cell in the grid, a tooltip appears displaying detailed information about that specific
+#    data point, enhancing the user's understanding of the data. The tooltip information includes the cell's position
+#    and layered data attributes.
 # 2) The visualization may be downloaded at any step in the model by simply shift-clicking on the canvas.  The
-#    resuling .svg file is a vector graphic that is perfectly scalable can be converted (using free desktop software 
-#    like Inkscape for MacOS, Linux, or Windows) to PDF for use in published works. 
-# 
+#    resuling .svg file is a vector graphic that is perfectly scalable can be converted (using free desktop software
+#    like Inkscape for MacOS, Linux, or Windows) to PDF for use in published works.
+#
 # The following are example options for visualizations compatable with the SVGGridModule:
 # ```python & mesa
 # def agent_portrayal(agent):
-#     aValue = 'A' + str(agent.unique_id)     
+#     aValue = 'A' + str(agent.unique_id)
 #     portrayal = {
 #         'Filled': 'true',
-#     } 
+#     }
 #     if agent.some_variable == True:
 #         portrayal['Shape'] = 'circle'
 #         portrayal['Layer'] = -1
@@ -105,97 +105,911 @@
 #         portrayal['scale'] = 0.8
 #     return portrayal
 # ```
-# 
-# Note that 'r' and 'scale' are effectively treated as identical and should be interchangable for all shapes 
+#
+# Note that 'r' and 'scale' are effectively treated as identical and should be interchangable for all shapes
 # and svg files.  'Color' and 'text_color' may be include HTML colour names, hex codes, and RGB codes.
-# 
+#
 # Although SVG has no z-index equivalent, this visualization module attempts to replicate the behaviour of
-# CSS z-index layering.  The range of meaningful z-index (or 'Layer') values is integers of -4 and greater.  
-# 'Layer' values work as one might expect CSS z-indices to work.  However, negative values (-4 through -1) will 
-# offer an added feature of displaying marginalia for any layer lower than the uppermost layer in that cell.  
-# These marginalia are denoted by a minturized version of the shape bearing the 'text' value and attached to 
+# CSS z-index layering.  The range of meaningful z-index (or 'Layer') values is integers of -4 and greater.
+# 'Layer' values work as one might expect CSS z-indices to work.  However, negative values (-4 through -1) will
+# offer an added feature of displaying marginalia for any layer lower than the uppermost layer in that cell.
+# These marginalia are denoted by a minturized version of the shape bearing the 'text' value and attached to
 # the actual shape by a line.  There is no requirement to use negative integer 'Layer' values if the marginalia
 # feature is not desirable.
-# 
-# 
+#
+#
 # LOCATIONS
-# 
-# This file is not currently forked in GitHub and must be manually placed in the following location (or similar 
-# depending on your particular installation) for it to function properly with the Mesa 1.2.1 package for Python 
+#
+# This file is not currently forked in GitHub and must be manually placed in the following location (or similar
+# depending on your particular installation) for it to function properly with the Mesa 1.2.1 package for Python
 # 3.9.6:
-# 
+#
 #    path/to/your/venv/lib/python3.9/site-packages/mesa/visualization/modules/SVGGridVisualization.py
-# 
+#
 # Keep in mind that any .svg files used in the context of portrayal['Shape'] must be placed in the following
 # location (or similar) for proper inclusion in your model visualization (you will need to create the 'images'
 # directory and may need to modify its permissions):
-# 
+#
 #    path/to/your/venv/lib/python3.9/site-packages/mesa/visualization/templates/images/
-# 
+#
 # As noted earlier, the visualization also requires a copy of the cognate SVGGridModule.js to be placed
 # in the following location (or similar):
-# 
+#
 #    path/to/your/venv/lib/python3.9/site-packages/mesa/visualization/templates/js/SVGGridModule.js
-# 
-# Consequentially, the module must also be imported, defined, and integrated into the ModularServer within your 
+#
+# Consequentially, the module must also be imported, defined, and integrated into the ModularServer within your
 # server.py code, as shown in the example below:
-# 
+#
 # ```python & mesa
 # from myAgents import *
 # from myModel import *
 # from mesa.visualization.modules.SVGGridVisualization import SVGGrid
 # from mesa.visualization.ModularVisualization import ModularServer
 # # ... other imports go here, as needed.
-# 
+#
 # # STARTING REQUIRED INPUT #
 # # vvvvvvvvvvvvvvvvvvvvvvv #
-# 
+#
 # agentcount = 20  # <-- The number of agents at model initialization
 # gridwidth = 10   # <-- The number of cells wide in the grid
 # gridheight = 10  # <-- The number of cells high in the grid
 # gridxinpx = 500  # <-- The number of pixels wide for the grid
 # gridyinpx = 500  # <-- The number of pixels high for the grid
-# 
+#
 # # SLIDER INPUT SETUP #
 # # vvvvvvvvvvvvvvvvvv #
-# 
+#
 # numberofagentsslider = UserSettableParameter(
-#   'slider', "Number of Agents", agentcount, 1, 100, 1) 
+#   'slider', "Number of Agents", agentcount, 1, 100, 1)
 #   # ^-- type, label, defaultval, minval, maxval, increment
-# 
+#
 # # SERVER DEFINITION #
 # # vvvvvvvvvvvvvvvvv #
-# 
+#
 # svg_grid = SVGGrid(agent_portrayal, gridwidth, gridheight, gridxinpx, gridyinpx)
 # server = ModularServer(MyModel, [svg_grid], "My Model", {"N": numberofagentsslider, "width": gridwidth, "height": gridheight})
-# 
+#
 # server.port = 8521
 # server.launch()
-# 
+#
 # ```
+#
+#
+# PORTRAYAL CACHING
+#
+# By default the portrayal_method is called for every agent on every step.  Agents whose appearance rarely
+# changes may opt in to caching by defining a `_portrayal_version` attribute.  The cached portrayal is reused
+# (with only 'x' and 'y' refreshed) for as long as the value of `_portrayal_version` is unchanged, so bump it
+# whenever a visual attribute changes:
+#
+# ```python & mesa
+# class MyAgent(Agent):
+#     def __init__(self, unique_id, model):
+#         super().__init__(unique_id, model)
+#         self._portrayal_version = 0
+#
+#     def step(self):
+#         if self.some_variable != self.some_other_variable:
+#             self.some_variable = self.some_other_variable
+#             self._portrayal_version += 1
+# ```
+#
+# Agents may instead (or as well) define a `_portrayal_dirty` flag: their cached portrayal is reused while the
+# flag is False, and SVGGrid resets the flag to False whenever it recomputes the portrayal, so set it to True
+# whenever a visual attribute changes.  SVGGrid then bumps a private `_portrayal_generation` attribute of the
+# agent, through which any other SVGGrid showing the same model notices the change as well:
+#
+# ```python & mesa
+#     def step(self):
+#         if self.some_variable != self.some_other_variable:
+#             self.some_variable = self.some_other_variable
+#             self._portrayal_dirty = True
+# ```
+#
+# Alternatively, call `svg_grid.invalidate(agent)` to discard a single cached portrayal.  When every agent
+# defines `_portrayal_version`, none has its `_portrayal_dirty` flag set, and no agent has moved or changed
+# its version since the previous step, the previous output is sent again without portraying any agent.
+#
+#
+# INCREMENTAL UPDATES
+#
+# Passing `diff=True` to SVGGrid makes each step send only what changed since the previous step, which
+# pays off when few agents change per step:
+#
+#    {'full_refresh': bool, 'added': [[key, portrayal], ...], 'removed': [key, ...], 'moved': [[key, x, y], ...]}
+#
+# 'added' holds new agents as well as agents whose portrayal changed, and 'full_refresh' is set on the first
+# step after the model is (re)created.  SVGGridModule.js applies the patch to its copy of the grid state.
+#
+# Passing `columnar=True` instead sends the grid state as one array per portrayal field, which is smaller
+# on the wire than a list of portrayals for large numbers of agents:
+#
+#    {'n': number of portrayals, 'columns': {'x': [...], 'y': [...], 'Shape': [...], 'Color': [...], ...}}
+#
+# When orjson is installed, the fields listed in NUMERIC_COLUMNS are packed into typed NumPy arrays if every
+# portrayal defines them as numbers of the column's kind that fit in its type; other values are sent as they
+# are, and missing values as null.  The two options cannot be combined.
+#
+#
+# VIEWPORT
+#
+# Agents outside the `viewport` attribute of SVGGrid, given as inclusive (x0, y0, x1, y1) cell bounds, are
+# skipped before their portrayal is computed.  The client may set it by calling `setViewport(x0, y0, x1, y1)`
+# on its SVGGridModule (or `setViewport(null)` to show the whole grid again); it applies from the next step.
+#
+#
+# PARALLEL PORTRAYAL
+#
+# Passing `parallel=True` computes portrayals on a thread pool.  This only pays off for portrayal methods
+# that spend most of their time in code releasing the GIL (NumPy, I/O, ...); for plain Python portrayal
+# methods it is slower than the default.
+#
+#
+# FRAME DROPPING
+#
+# The ModularServer numbers the frames it sends in the `frame` attribute of SVGGrid, and SVGGridModule.js
+# acknowledges every frame once it has been drawn (including any custom .svg files).  While the client is
+# more than one frame behind, `render` returns None and the client keeps showing the previous frame, so a
+# slow browser is not flooded with frames it cannot draw.  The final step of a run is always sent.
+#
+#
+# BINARY FRAMES
+#
+# Passing `binary=True` sends the grid state in a binary websocket frame (see `render_binary`) rather than as
+# JSON: positions are packed as 16-bit integers and each distinct portrayal is sent once per step.  The
+# grid may then be at most 32767 cells wide and high.
+#
+#
+# STREAMING
+#
+# For very large grids, passing `stream_batch=1000` (say) sends the grid state in batches of at most that
+# many portrayals, letting the server handle other events between batches and the browser draw each batch
+# as it arrives rather than freezing until the whole state has been parsed.  This takes slightly longer in
+# total, and cannot be combined with the diff, columnar or binary options.
+#
+#
+# LAZY TEXT
+#
+# Passing `lazy_text=True` leaves the TEXT_FIELDS ('text' and 'text_color') out of the grid state.  The text is
+# then not drawn on the grid; SVGGridModule.js fetches it from `get_tooltip` when a cell is first hovered over
+# in a step, for its tooltip.  This shrinks the grid state of models labelling every agent.
+#
+#
+# CANVAS RENDERING
+#
+# Past a few thousand agents the browser spends most of each step maintaining the SVG elements.  SVGGridCanvas
+# takes the same arguments as SVGGrid (bar the diff, columnar, binary and stream_batch options) plus a
+# `threshold`, and sends each step as
+#
+#    {'mode': 'canvas' or 'svg', 'data': [portrayal, ...]}
+#
+# SVGGridCanvasModule.js draws steps of more than `threshold` portrayals on an HTML5 canvas, and smaller
+# ones with SVGGridModule.js as usual.  The canvas keeps the shapes, colours, layers and text of the agents,
+# but draws no marginalia and shows no tooltips, and cannot be downloaded by shift-clicking.
+#
+# ```python & mesa
+# from mesa.visualization.modules.SVGGridVisualization import SVGGridCanvas
+#
+# svg_grid = SVGGridCanvas(agent_portrayal, gridwidth, gridheight, gridxinpx, gridyinpx, threshold=5000)
+# ```
+#
+#
+# SERIALIZATION
+#
+# The ModularServer asks this module to serialize its own state through `render_json`, which uses the
+# `orjson` package when it is installed and falls back to the standard library `json` module otherwise.
+# `render` itself returns a list of (x, y, portrayal) tuples, and the positions are only set on the portrayals
+# in the JSON.
+# The ROUNDED_FIELDS of each portrayal are rounded to FLOAT_PRECISION decimal places and rgb() colours are
+# compacted (e.g. 'rgb(178.2, 34, 34)' becomes 'rgb(178,34,34)') on the way out, and the INTERNED_FIELDS
+# are interned so that equal strings built anew on every step share a single object; the portrayal dict
+# itself is never modified.  The JSON of cached portrayals is reused for as long as their `_portrayal_version`
+# is unchanged.  When all portrayals of the first step define the same fields, the rounding is done by a
+# function generated for those fields, which is noticeably faster for the common portrayal methods that
+# always return the same keys.
+
+
+import asyncio
+import json
+import os
+import re
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
+import numpy as np
 
 from mesa.visualization.ModularVisualization import VisualizationElement
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Number of decimal places kept for the ROUNDED_FIELDS sent to the client.
+FLOAT_PRECISION = 2
+ROUNDED_FIELDS = ("r", "scale")
+COLOR_FIELDS = ("Color", "text_color")
+# String fields whose equal values are replaced by a single interned string.
+INTERNED_FIELDS = ("Shape", *COLOR_FIELDS)
+# Fields left out of the grid state, and sent on request, when lazy_text is set.
+TEXT_FIELDS = ("text", "text_color")
+
+_RGB = re.compile(r"rgb\(\s*([\d.]+)\s*,\s*([\d.]+)\s*,\s*([\d.]+)\s*\)")
+
+if orjson is not None:
+
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+else:
+    # json.dumps builds a new JSONEncoder on every call with non-default arguments.
+    _dumps = json.JSONEncoder(separators=(",", ":")).encode
+
+
+# Portrayal fields packed into typed arrays by the columnar layout, provided that
+# every portrayal in the frame defines them.
+NUMERIC_COLUMNS = {
+    "x": np.int32,
+    "y": np.int32,
+    "Layer": np.int16,
+    "r": np.float32,
+    "scale": np.float32,
+}
+
+
+def _compact_color(color):
+    match = _RGB.fullmatch(color)
+    if match is None:
+        return color
+    return "rgb({},{},{})".format(*(round(float(c)) for c in match.groups()))
+
+
+# Maps field values seen in ROUNDED_FIELDS and INTERNED_FIELDS to their short
+# (and, for strings, interned) form, which doubles as a pool of the strings in
+# use.  Portrayals draw these from a small set of values, so this is nearly
+# always a hit; it is cleared should it grow past _SHORT_VALUES_MAX entries.
+_short_values = {}
+_SHORT_VALUES_MAX = 4096
+
+
+def _shorten(v):
+    if type(v) is float:
+        short = round(v, FLOAT_PRECISION)
+    elif type(v) is str:
+        short = sys.intern(_compact_color(v))
+    else:
+        short = v
+    if short == v and type(short) is not str:
+        short = v
+    if len(_short_values) >= _SHORT_VALUES_MAX:
+        _short_values.clear()
+    _short_values[v] = short
+    return short
+
+
+def _round_portrayal(
+    portrayal, _fields=ROUNDED_FIELDS + INTERNED_FIELDS, _cached=_short_values.get
+):
+    """Return `portrayal`, or a copy of it if any field needs rounding or interning."""
+    rounded = None
+    for k in _fields:
+        if k in portrayal:
+            v = portrayal[k]
+            try:
+                short = _cached(v)
+            except TypeError:
+                # Unhashable values are passed through as they are.
+                continue
+            if short is None:
+                short = _shorten(v)
+            if short is not v:
+                if rounded is None:
+                    rounded = dict(portrayal)
+                rounded[k] = short
+    return portrayal if rounded is None else rounded
+
+
+# Functions generated by _specialize_round_portrayal, by the fields they handle.
+_specialized = {}
+
+
+def _specialize_round_portrayal(portrayals, _fields=ROUNDED_FIELDS + INTERNED_FIELDS):
+    """Return a function equivalent to _round_portrayal, specialized for the
+    fields that `portrayals` define if they all define the same ones, or else
+    _round_portrayal itself.
+
+    The specialized function reads the fields it expects without testing for
+    them first, and only checks that the others are absent, which takes about
+    40% less time.  Portrayals of another shape fall back to _round_portrayal,
+    at roughly twice its cost.
+    """
+    shapes = {tuple(k for k in _fields if k in portrayal) for portrayal in portrayals}
+    if len(shapes) != 1:
+        return _round_portrayal
+    (present,) = shapes
+    function = _specialized.get(present)
+    if function is not None:
+        return function
+    lines = [
+        "def _round(portrayal, _cached=_cached, _shorten=_shorten, _generic=_round_portrayal):"
+    ]
+    for k in _fields:
+        if k not in present:
+            lines += [
+                f"    if {k!r} in portrayal:",
+                "        return _generic(portrayal)",
+            ]
+    if present:
+        values = [f"v{i}" for i in range(len(present))]
+        shorts = [f"s{i}" for i in range(len(present))]
+        lines += ["    try:"]
+        lines += [f"        {v} = portrayal[{k!r}]" for v, k in zip(values, present)]
+        lines += [
+            "    except KeyError:",
+            "        return _generic(portrayal)",
+            "    try:",
+        ]
+        lines += [f"        {short} = _cached({v})" for short, v in zip(shorts, values)]
+        lines += ["    except TypeError:", "        return _generic(portrayal)"]
+        for short, v in zip(shorts, values):
+            lines += [f"    if {short} is None:", f"        {short} = _shorten({v})"]
+        lines += [
+            "    if "
+            + " and ".join(f"{short} is {v}" for short, v in zip(shorts, values))
+            + ":"
+        ]
+        lines += ["        return portrayal", "    portrayal = dict(portrayal)"]
+        lines += [
+            f"    portrayal[{k!r}] = {short}" for k, short in zip(present, shorts)
+        ]
+    lines += ["    return portrayal"]
+    namespace = {
+        "_cached": _short_values.get,
+        "_shorten": _shorten,
+        "_round_portrayal": _round_portrayal,
+    }
+    # The source is built only from the constant field names in _fields, never
+    # from portrayal data; generating it is what removes the per-field loop.
+    code = compile("\n".join(lines), "<_round_portrayal>", "exec")
+    exec(code, namespace)  # noqa: S102
+    function = _specialized[present] = namespace["_round"]
+    return function
+
+
+def _round_portrayal_without_text(portrayal, _round=_round_portrayal):
+    """Return `portrayal` as _round_portrayal does, less its TEXT_FIELDS."""
+    portrayal = _round(portrayal)
+    if "text" in portrayal or "text_color" in portrayal:
+        return {k: v for k, v in portrayal.items() if k not in TEXT_FIELDS}
+    return portrayal
+
+
+def _pack_column(column, dtype):
+    """Return `column` as a NumPy array of `dtype`, or None unless all its values
+    are numbers of the kind of `dtype` (ints for an integer type) that fit in it."""
+    if np.dtype(dtype).kind == "i":
+        if not all(type(v) is int for v in column):
+            return None
+        info = np.iinfo(dtype)
+    else:
+        if not all(type(v) is float or type(v) is int for v in column):
+            return None
+        info = np.finfo(dtype)
+    if column and (min(column) < info.min or max(column) > info.max):
+        return None
+    return np.array(column, dtype=dtype)
+
+
+def _dirty_generation(agent, dirty):
+    """Turn a set `_portrayal_dirty` flag of `agent` into a bump of its
+    `_portrayal_generation`, and return the latter.
+
+    Whichever SVGGrid renders first clears the flag, so the other elements
+    showing the same model notice the change through the generation, which
+    their cache entries record along with the portrayal version.
+    """
+    generation = getattr(agent, "_portrayal_generation", 0)
+    if dirty:
+        generation += 1
+        agent._portrayal_generation = generation
+        agent._portrayal_dirty = False
+    return generation
+
+
+def _portray_agents(
+    agents, portray, cached, cache, keys=None, _getattr=getattr, _id=id
+):
+    """Portray `agents` and return parallel lists (xs, ys, portrayals) of the
+    positions and truthy portrayals.
+
+    The portrayal dicts are not modified, so the portrayal_method is free to
+    return the same (or an immutable) mapping for many agents.  Parallel lists
+    are used rather than a list of tuples because they allocate no container
+    per agent for the garbage collector to track.
+
+    `cached` looks up (agent, version, portrayal) entries of the previous frame
+    by id(agent); entries for this frame are stored in `cache`.  An entry is only
+    reused by the agent it was made for, as a new agent may be given the id of
+    one that has since been removed.  If `keys` is a
+    list, the id of each portrayed agent is appended to it.  This is the hot
+    loop of SVGGrid, so everything it touches is bound to a local name.
+    """
+    # The lists are allocated at their largest possible size up front and cut
+    # down to the number of portrayals at the end, rather than grown by append.
+    n = len(agents)
+    xs = [None] * n
+    ys = [None] * n
+    portrayals = [None] * n
+    i = 0
+    for agent in agents:
+        version = _getattr(agent, "_portrayal_version", None)
+        dirty = _getattr(agent, "_portrayal_dirty", None)
+        if version is None and dirty is None:
+            portrayal = portray(agent)
+        else:
+            if dirty is not None:
+                version = (version, _dirty_generation(agent, dirty))
+            key = _id(agent)
+            entry = cached(key)
+            if entry is not None and entry[0] is agent and entry[1] == version:
+                portrayal = entry[2]
+            else:
+                portrayal = portray(agent)
+            cache[key] = (agent, version, portrayal)
+        if portrayal:
+            xs[i], ys[i] = agent.pos
+            portrayals[i] = portrayal
+            i += 1
+            if keys is not None:
+                keys.append(_id(agent))
+    del xs[i:], ys[i:], portrayals[i:]
+    return xs, ys, portrayals
+
+
+_INT16_MAX = 32767
+
+
+def _unchanged_patch():
+    return {"full_refresh": False, "added": [], "removed": [], "moved": []}
+
+
 class SVGGrid(VisualizationElement):
     package_includes = ["SVGGridModule.js"]
+    server_protocol = True
 
-    def __init__(self, portrayal_method, grid_width, grid_height, canvas_width=500, canvas_height=500):
+    def __init__(
+        self,
+        portrayal_method,
+        grid_width,
+        grid_height,
+        canvas_width=500,
+        canvas_height=500,
+        diff=False,
+        columnar=False,
+        parallel=False,
+        binary=False,
+        stream_batch=None,
+        lazy_text=False,
+    ):
+        if diff and columnar:
+            raise ValueError("diff and columnar cannot be combined")
+        if binary and max(grid_width, grid_height) > _INT16_MAX:
+            raise ValueError(f"binary requires grid dimensions of at most {_INT16_MAX}")
+        if stream_batch is not None and (diff or columnar or binary):
+            raise ValueError(
+                "stream_batch cannot be combined with diff, columnar or binary"
+            )
         self.portrayal_method = portrayal_method
         self.grid_width = grid_width
         self.grid_height = grid_height
         self.canvas_width = canvas_width
         self.canvas_height = canvas_height
-        new_element = "new SVGGridModule({}, {}, {}, {})"
-        new_element = new_element.format(self.canvas_width, self.canvas_height, self.grid_width, self.grid_height)
-        self.js_code = "window.onload = function() {elements.push(" + new_element + ");};"
-
-    def render(self, model):
-        grid_state = []
-        for agent in model.schedule.agents:
-            portrayal = self.portrayal_method(agent)
-            if portrayal:
-                portrayal["x"] = agent.pos[0]
-                portrayal["y"] = agent.pos[1]
-                grid_state.append(portrayal)
-        return grid_state
+        options = ", {lazyText: true}" if lazy_text else ""
+        self.js_code = (
+            "window.onload = function() {elements.push(new SVGGridModule("
+            f"{canvas_width}, {canvas_height}, {grid_width}, {grid_height}{options}));}};"
+        )
+        # Maps id(agent) -> (agent, portrayal version, portrayal) for agents that opt in
+        # to caching by exposing a `_portrayal_version` or `_portrayal_dirty` attribute.
+        self._portrayal_cache = {}
+        # Maps id(portrayal) -> (portrayal, JSON of the portrayal without its closing
+        # brace) for cached portrayals.
+        self._fragment_cache = {}
+        # When diff is set, render() returns patches against the previous frame.
+        self.diff = diff
+        self._diff_model = None
+        # Maps id(agent) -> ((x, y), portrayal items).
+        self._prev_state = {}
+        # When columnar is set, render() returns one array per portrayal field.
+        self.columnar = columnar
+        # Inclusive (x0, y0, x1, y1) bounds of the cells visible in the client, or None
+        # to render the whole grid.  Set by the client through the ModularServer.
+        self.viewport = None
+        # When parallel is set, portrayals are computed on a thread pool, created on first use.
+        self.parallel = parallel
+        self._pool = None
+        # Number of the frame being rendered, set by the ModularServer, and of the last
+        # frame the client reported as drawn; frames are dropped while it lags behind.
+        self.frame = None
+        self._client_ack_frame = None
+        # (fingerprint, output) of the last render and render_json calls.
+        self._last_render = (None, None)
+        self._last_json = (None, None)
+        # When binary is set, the ModularServer sends render_binary() in a binary frame.
+        self.binary = binary
+        # When stream_batch is set, the ModularServer sends render_stream() batches of
+        # at most this many portrayals ahead of the viz_state message.
+        self.stream_batch = stream_batch
+        # When lazy_text is set, the TEXT_FIELDS are left out of the grid state and
+        # the client fetches them through get_tooltip.
+        self.lazy_text = lazy_text
+        # _round_portrayal specialized for the fields of the first frame's portrayals.
+        self._round_portrayal = None
+
+    def invalidate(self, agent):
+        """Force the portrayal of `agent` to be recomputed on the next render."""
+        self._portrayal_cache.pop(id(agent), None)
+        self._last_render = self._last_json = (None, None)
+
+    def ack(self, frame):
+        """Record that the client has finished drawing `frame`."""
+        self._client_ack_frame = frame
+
+    def get_tooltip(self, model, x, y):
+        """Return the 'Layer' and TEXT_FIELDS of the portrayals of the agents in
+        cell (x, y), ordered by layer, for the tooltip of that cell."""
+        portrayals = [
+            self.portrayal_method(a) for a in model.schedule.agents if a.pos == (x, y)
+        ]
+        fields = ("Layer", *TEXT_FIELDS)
+        return [
+            {k: portrayal[k] for k in fields if k in portrayal}
+            for portrayal in sorted(
+                filter(None, portrayals), key=lambda p: p.get("Layer", 0)
+            )
+        ]
+
+    @property
+    def _prepare_portrayal(self):
+        """The function preparing each portrayal for the client."""
+        round_portrayal = self._round_portrayal or _round_portrayal
+        if self.lazy_text:
+            return partial(_round_portrayal_without_text, _round=round_portrayal)
+        return round_portrayal
+
+    def _learn_portrayal_shape(self, portrayals):
+        # The fields defined by the portrayals of the first frame decide how the
+        # portrayals are rounded from then on.
+        if self._round_portrayal is None and portrayals:
+            self._round_portrayal = _specialize_round_portrayal(portrayals)
+
+    def _is_lagging(self, model):
+        ack = self._client_ack_frame
+        if ack is None or self.frame is None:
+            return False
+        # Never drop the final frame of a run.
+        return getattr(model, "running", True) and self.frame - ack > 1
+
+    def _fingerprint(self, model, viewport):
+        """Return everything the output depends on, or None if that is unknown
+        because some agent does not define a portrayal version or has its
+        `_portrayal_dirty` flag set.
+
+        The agents, positions and versions are compared as they are rather than
+        hashed, so that a hash collision cannot produce a stale frame; comparing
+        mostly hits the identity shortcut, as unchanged positions are the same
+        tuples.  The agents are included so that an agent replaced by another
+        at the same position and version is noticed, and their portrayal
+        generations so that a `_portrayal_dirty` flag cleared by another
+        SVGGrid is noticed as well.
+        """
+        if viewport is None:
+            viewport = self.viewport
+        agents = model.schedule.agents
+        try:
+            versions = [
+                (a, a.pos, a._portrayal_version, getattr(a, "_portrayal_generation", 0))
+                for a in agents
+            ]
+        except AttributeError:
+            return None
+        if any(getattr(a, "_portrayal_dirty", False) for a in agents):
+            return None
+        return (model, viewport, versions)
+
+    def render(self, model, viewport=None):
+        """Render the grid state as a list of (x, y, portrayal) tuples; agents
+        outside `viewport` (or self.viewport) are skipped.
+
+        Returns None, which the client ignores, while the client is more than a
+        frame behind in drawing.  If every agent defines a portrayal version and
+        neither these nor the agent positions changed, the previous output is
+        returned without portraying any agent (an empty patch in diff mode).
+        """
+        if self._is_lagging(model):
+            return None
+        fingerprint = self._fingerprint(model, viewport)
+        if fingerprint is not None and fingerprint == self._last_render[0]:
+            return _unchanged_patch() if self.diff else self._last_render[1]
+        output = self._render(model, viewport)
+        self._last_render = (fingerprint, output)
+        return output
+
+    def _render(self, model, viewport):
+        if self.diff:
+            return self._render_diff(model, viewport)
+        if self.columnar:
+            return self._render_columns(model, viewport)
+        xs, ys, portrayals = self._render_state(model, viewport)
+        return list(zip(xs, ys, map(self._prepare_portrayal, portrayals)))
+
+    def _visible_agents(self, model, viewport):
+        agents = model.schedule.agents
+        if viewport is None:
+            viewport = self.viewport
+        if viewport is not None:
+            x0, y0, x1, y1 = viewport
+            agents = [
+                a for a in agents if x0 <= a.pos[0] <= x1 and y0 <= a.pos[1] <= y1
+            ]
+        return agents
+
+    def _render_state(self, model, viewport=None, keys=None):
+        agents = self._visible_agents(model, viewport)
+        cached = self._portrayal_cache.get
+        portray = self.portrayal_method
+        if self.parallel:
+            portray = self._portray_in_pool(agents, cached)
+        cache = {}
+        frame = _portray_agents(agents, portray, cached, cache, keys)
+        # Rebuilding the cache each frame drops agents that have left the schedule
+        # (or the viewport).
+        self._portrayal_cache = cache
+        self._learn_portrayal_shape(frame[2])
+        return frame
+
+    def _portray_in_pool(self, agents, cached):
+        """Portray the agents that miss the portrayal cache on the thread pool and
+        return a function looking up the results, to stand in for portrayal_method."""
+        todo = []
+        for agent in agents:
+            version = getattr(agent, "_portrayal_version", None)
+            dirty = getattr(agent, "_portrayal_dirty", None)
+            if version is None and dirty is None:
+                todo.append(agent)
+            else:
+                if dirty is not None:
+                    version = (version, _dirty_generation(agent, dirty))
+                entry = cached(id(agent))
+                if entry is None or entry[0] is not agent or entry[1] != version:
+                    todo.append(agent)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+        results = dict(zip(map(id, todo), self._pool.map(self.portrayal_method, todo)))
+        return lambda agent: results[id(agent)]
+
+    def _render_diff(self, model, viewport=None):
+        keys = []
+        xs, ys, portrayals = self._render_state(model, viewport, keys)
+        # A new model instance means the client has been reset and holds no state.
+        full_refresh = model is not self._diff_model
+        previous = {} if full_refresh else self._prev_state
+        prepare = self._prepare_portrayal
+        current = {}
+        added = []
+        moved = []
+        for key, x, y, portrayal in zip(keys, xs, ys, portrayals):
+            pos = (x, y)
+            look = tuple(portrayal.items())
+            current[key] = (pos, look)
+            entry = previous.get(key)
+            if entry is None or entry[1] != look:
+                added.append([key, dict(prepare(portrayal), x=x, y=y)])
+            elif entry[0] != pos:
+                moved.append([key, x, y])
+        removed = list(previous.keys() - current.keys())
+        self._diff_model = model
+        self._prev_state = current
+        return {
+            "full_refresh": full_refresh,
+            "added": added,
+            "removed": removed,
+            "moved": moved,
+        }
+
+    def _render_columns(self, model, viewport=None, pack=False):
+        xs, ys, portrayals = self._render_state(model, viewport)
+        n = len(portrayals)
+        prepare = self._prepare_portrayal
+        columns = {}
+        for i, portrayal in enumerate(portrayals):
+            for k, v in prepare(portrayal).items():
+                column = columns.get(k)
+                if column is None:
+                    column = columns[k] = [None] * n
+                column[i] = v
+        columns["x"] = xs
+        columns["y"] = ys
+        if pack:
+            for k, dtype in NUMERIC_COLUMNS.items():
+                column = columns.get(k)
+                if column is not None:
+                    array = _pack_column(column, dtype)
+                    if array is not None:
+                        columns[k] = array
+        return {"n": n, "columns": columns}
+
+    def render_json(self, model, viewport=None):
+        """Render the grid state and serialize it to a JSON array string of the
+        portrayals, with 'x' and 'y' set on each.
+
+        With diff or columnar enabled, the object returned by render is serialized instead.
+        """
+        if self._is_lagging(model):
+            return "null"
+        if self.binary:
+            # The state itself travels in the binary frame sent ahead of this message.
+            return '{"binary":true}'
+        if self.stream_batch is not None:
+            # Likewise for the batches of render_stream.
+            return '{"stream":true}'
+        fingerprint = self._fingerprint(model, viewport)
+        if fingerprint is not None and fingerprint == self._last_json[0]:
+            return _dumps(_unchanged_patch()) if self.diff else self._last_json[1]
+        output = self._render_json(model, viewport)
+        self._last_json = (fingerprint, output)
+        return output
+
+    def _render_json(self, model, viewport):
+        if self.diff:
+            return _dumps(self._render_diff(model, viewport))
+        if self.columnar:
+            # Only orjson serializes NumPy arrays, and without the round trip.
+            payload = self._render_columns(model, viewport, pack=orjson is not None)
+            columns = payload["columns"]
+            for k, column in columns.items():
+                if type(column) is not list and column.dtype.kind == "f":
+                    columns[k] = column.round(FLOAT_PRECISION)
+            return _dumps(payload)
+        xs, ys, portrayals = self._render_state(model, viewport)
+        return self._records_json(xs, ys, portrayals)
+
+    def _records_json(self, xs, ys, portrayals):
+        cached_ids = {id(entry[2]) for entry in self._portrayal_cache.values()}
+        prepare = self._prepare_portrayal
+        if orjson is None and not cached_ids:
+            # Without orjson, a single call over all the records is about twice as
+            # fast as a call per portrayal, and there are no fragments to reuse.
+            self._fragment_cache = {}
+            return _dumps(
+                [dict(prepare(p), x=x, y=y) for x, y, p in zip(xs, ys, portrayals)]
+            )
+        previous = self._fragment_cache.get
+        fragments = {}
+        out = []
+        append = out.append
+        for x, y, portrayal in zip(xs, ys, portrayals):
+            key = id(portrayal)
+            if key in cached_ids:
+                entry = previous(key)
+                if entry is not None and entry[0] is portrayal:
+                    fragment = entry[1]
+                else:
+                    fragment = _dumps(prepare(portrayal))[:-1]
+                fragments[key] = (portrayal, fragment)
+            else:
+                fragment = _dumps(prepare(portrayal))[:-1]
+            # Positions are spliced in rather than set on the portrayal; should the
+            # portrayal define 'x' or 'y' itself, the later keys win when parsed.
+            append(f'{fragment},"x":{x},"y":{y}}}')
+        self._fragment_cache = fragments
+        return "[" + ",".join(out) + "]"
+
+    def render_binary(self, model, viewport=None):
+        """Render the grid state as bytes for a binary websocket frame, or None
+        while the client lags behind (see render).
+
+        Layout, little-endian: uint32 n, int16[n] x, int16[n] y, uint32[n]
+        index of each agent's portrayal in the table that follows, which is a
+        UTF-8 JSON array of the distinct portrayals (without x and y).
+        """
+        if self._is_lagging(model):
+            return None
+        xs, ys, portrayals = self._render_state(model, viewport)
+        prepare = self._prepare_portrayal
+        table = {}
+        by_id = {}
+        indices = []
+        append = indices.append
+        for portrayal in portrayals:
+            key = id(portrayal)
+            index = by_id.get(key)
+            if index is None:
+                fragment = _dumps(prepare(portrayal))
+                index = by_id[key] = table.setdefault(fragment, len(table))
+            append(index)
+        return b"".join(
+            [
+                struct.pack("<I", len(portrayals)),
+                np.array(xs, dtype="<i2").tobytes(),
+                np.array(ys, dtype="<i2").tobytes(),
+                np.array(indices, dtype="<u4").tobytes(),
+                ("[" + ",".join(table) + "]").encode(),
+            ]
+        )
+
+    async def render_stream(self, model, batch=None, viewport=None):
+        """Render the grid state in batches of at most `batch` (default:
+        self.stream_batch) portrayals, yielding (start, portrayals) for each and
+        handing control back to the event loop in between.
+
+        Nothing is yielded while the client lags behind (see render).
+        """
+        if self._is_lagging(model):
+            return
+        if batch is None:
+            batch = self.stream_batch
+        agents = self._visible_agents(model, viewport)
+        cached = self._portrayal_cache.get
+        cache = {}
+        start = 0
+        # An empty grid still yields one (empty) batch, to replace the previous state.
+        for offset in range(0, len(agents), batch) or (0,):
+            chunk = agents[offset : offset + batch]
+            portray = self.portrayal_method
+            if self.parallel:
+                portray = self._portray_in_pool(chunk, cached)
+            xs, ys, portrayals = _portray_agents(chunk, portray, cached, cache)
+            self._learn_portrayal_shape(portrayals)
+            prepare = self._prepare_portrayal
+            yield start, [
+                dict(prepare(p), x=x, y=y) for x, y, p in zip(xs, ys, portrayals)
+            ]
+            start += len(portrayals)
+            await asyncio.sleep(0)
+        self._portrayal_cache = cache
+
+
+class SVGGridCanvas(SVGGrid):
+    """SVGGrid drawn on an HTML5 canvas rather than as SVG when more than
+    `threshold` portrayals are visible (see CANVAS RENDERING above)."""
+
+    package_includes = ["SVGGridModule.js", "SVGGridCanvasModule.js"]
+
+    def __init__(
+        self,
+        portrayal_method,
+        grid_width,
+        grid_height,
+        canvas_width=500,
+        canvas_height=500,
+        threshold=5000,
+        parallel=False,
+    ):
+        super().__init__(
+            portrayal_method,
+            grid_width,
+            grid_height,
+            canvas_width,
+            canvas_height,
+            parallel=parallel,
+        )
+        self.threshold = threshold
+        self.js_code = (
+            "window.onload = function() {elements.push(new SVGGridCanvasModule("
+            f"{canvas_width}, {canvas_height}, {grid_width}, {grid_height}));}};"
+        )
+
+    def _mode(self, n):
+        return "canvas" if n > self.threshold else "svg"
+
+    def _render(self, model, viewport):
+        data = super()._render(model, viewport)
+        return {"mode": self._mode(len(data)), "data": data}
+
+    def _render_json(self, model, viewport):
+        xs, ys, portrayals = self._render_state(model, viewport)
+        data = self._records_json(xs, ys, portrayals)
+        return f'{{"mode":"{self._mode(len(portrayals))}","data":{data}}}'
@@ -0,0 +1,189 @@
+// SVGGridCanvasModule for Mesa
+//
+// Companion of SVGGridModule.js, distributed under the same license.
+//
+// Draws the grid state sent by SVGGridCanvas on an HTML5 canvas when the server
+// flags a step with mode 'canvas', which keeps large grids responsive, and hands
+// any other step to an SVGGridModule so that small grids keep their marginalia,
+// tooltips and SVG download.  The canvas draws the main shape, colour and text
+// of the first agent per layer of each cell, in layer order, exactly where
+// SVGGridModule would draw them.
+
+var SVGGridCanvasModule = function (canvas_width, canvas_height, grid_width, grid_height) {
+
+    var elementsDiv = document.getElementById('elements');
+
+    // SVGGridModule appends its svg element to #elements
+    var svgModule = new SVGGridModule(canvas_width, canvas_height, grid_width, grid_height, {owner: this});
+    var svgNode = elementsDiv.lastElementChild;
+
+    var canvas = document.createElement('canvas');
+    canvas.width = canvas_width;
+    canvas.height = canvas_height;
+    canvas.style.display = 'none';
+    elementsDiv.appendChild(canvas);
+    var context = canvas.getContext('2d');
+
+    var cell_width = canvas_width / grid_width;
+    var cell_height = canvas_height / grid_height;
+    var cell_size = Math.min(cell_width, cell_height);
+
+    // Custom .svg shapes, loaded once per file; those that failed to load are skipped
+    var images = new Map();
+
+    // Number of the last frame drawn on the canvas
+    var frame = 0;
+
+    var loadImage = function (shape) {
+        var entry = images.get(shape);
+        if (entry === undefined) {
+            var image = new Image();
+            entry = {image: image, failed: false};
+            entry.loaded = new Promise(function(resolve) {
+                image.onload = resolve;
+                image.onerror = function() {
+                    entry.failed = true;
+                    resolve();
+                };
+            });
+            image.src = 'static/images/' + shape;
+            images.set(shape, entry);
+        }
+        return entry;
+    };
+
+    var showCanvas = function (visible) {
+        canvas.style.display = visible ? '' : 'none';
+        svgNode.style.display = visible ? 'none' : '';
+    };
+
+    var sendAck = function (element, serverFrame) {
+        send({type: 'ack', index: elements.indexOf(element), frame: serverFrame});
+    };
+
+    var drawGridlines = function () {
+        context.strokeStyle = 'black';
+        context.lineWidth = 0.25;
+        context.beginPath();
+        for (var i = 0; i <= grid_width; i++) {
+            context.moveTo(i * cell_width, 0);
+            context.lineTo(i * cell_width, canvas_height);
+        }
+        for (var j = 0; j <= grid_height; j++) {
+            context.moveTo(0, j * cell_height);
+            context.lineTo(canvas_width, j * cell_height);
+        }
+        context.stroke();
+    };
+
+    // Draw the data on the canvas and return the images still loading
+    var draw = function (data) {
+        var pending = [];
+
+        context.clearRect(0, 0, canvas_width, canvas_height);
+        drawGridlines();
+
+        data.sort(function(a, b) {
+            return a.Layer - b.Layer;
+        });
+
+        // Only the first agent per layer of each cell is drawn, as in SVGGridModule
+        var drawn = new Set();
+        context.textAlign = 'center';
+        context.textBaseline = 'middle';
+        context.font = (cell_size / 2) + 'px sans-serif';
+
+        data.forEach(function(d) {
+            var y = grid_height - d.y - 1;
+            var key = d.x + ',' + y + ',' + d.Layer;
+            if (drawn.has(key)) {
+                return;
+            }
+            drawn.add(key);
+
+            // allow for use of either portrayal['r'] or ...['scale']
+            var r = typeof d.scale !== 'undefined' ? d.scale : d.r;
+            var xPos = d.x * cell_width + cell_width / 2;
+            var yPos = y * cell_height + cell_height / 2;
+            var halfSize = r * cell_size / 2;
+
+            context.fillStyle = d.Color;
+            if (d.Shape.endsWith('.svg')) {
+                var entry = loadImage(d.Shape);
+                if (entry.image.complete) {
+                    // A broken image is complete too, but drawImage throws on it
+                    if (!entry.failed) {
+                        context.drawImage(entry.image, xPos - r * cell_width / 2, yPos - r * cell_height / 2,
+                            r * cell_width, r * cell_height);
+                    }
+                } else {
+                    pending.push(entry.loaded);
+                }
+            } else if (d.Shape === 'square') {
+                context.fillRect(xPos - halfSize, yPos - halfSize, 2 * halfSize, 2 * halfSize);
+            } else if (d.Shape === 'circle') {
+                context.beginPath();
+                context.arc(xPos, yPos, halfSize, 0, 2 * Math.PI);
+                context.fill();
+            } else if (d.Shape === 'triangle') {
+                context.beginPath();
+                context.moveTo(xPos - halfSize, yPos + halfSize);
+                context.lineTo(xPos + halfSize, yPos + halfSize);
+                context.lineTo(xPos, yPos - halfSize);
+                context.closePath();
+                context.fill();
+            }
+
+            if (typeof d.text !== 'undefined') {
+                context.fillStyle = d.text_color || 'black';
+                context.fillText(d.text, xPos, yPos);
+            }
+        });
+        return pending;
+    };
+
+    this.setViewport = svgModule.setViewport;
+    this.receiveTooltip = svgModule.receiveTooltip;
+
+    this.reset = function () {
+        svgModule.reset();
+        context.clearRect(0, 0, canvas_width, canvas_height);
+        showCanvas(false);
+    };
+
+    this.render = function (payload) {
+        var serverFrame = control.frame;
+
+        // The server skipped this frame because we were falling behind
+        if (payload === null) {
+            sendAck(this, serverFrame);
+            return;
+        }
+
+        if (payload.mode !== 'canvas') {
+            showCanvas(false);
+            svgModule.render(payload.data);
+            return;
+        }
+
+        // Drop the SVG elements, so that switching back redraws them all
+        svgModule.reset();
+        showCanvas(true);
+
+        var element = this;
+        var current = ++frame;
+        var pending = draw(payload.data);
+        if (pending.length === 0) {
+            sendAck(element, serverFrame);
+        } else {
+            // Redraw once the custom .svg shapes have loaded
+            Promise.all(pending).then(function() {
+                if (current === frame) {
+                    draw(payload.data);
+                }
+            }).finally(function() {
+                sendAck(element, serverFrame);
+            });
+        }
+    };
+};
@@ -201,7 +201,16 @@ var script = document.createElement('script');
 script.src = 'https://d3js.org/d3.v5.min.js';
 script.onload = function() {
     // D3.js is loaded, you can use it here
-    window.SVGGridModule = function (canvas_width, canvas_height, grid_width, grid_height) {
+    window.SVGGridModule = function (canvas_width, canvas_height, grid_width, grid_height, options) {
+        options = options || {};
+
+        // The element known to the server; another module drawing through this
+        // one (see SVGGridCanvasModule.js) passes itself as options.owner
+        var self = options.owner || this;
+
+        // Whether the server leaves the text out of the grid state, to be
+        // fetched for the tooltips on demand (SVGGrid(lazy_text=True))
+        var lazyText = !!options.lazyText;
 
         // Create SVG element
         var svg = d3.select('#elements')
@@ -241,11 +250,191 @@ script.onload = function() {
                 .style('stroke-dasharray', '0.25,0.25');
         }
 
+        // Last known portrayal per agent key, used when the server sends patches
+        // (SVGGrid(diff=True)) rather than the full grid state
+        var agentState = new Map();
+
+        var applyPatch = function (patch) {
+            if (patch.full_refresh) {
+                agentState.clear();
+            }
+            patch.removed.forEach(function(key) {
+                agentState.delete(key);
+            });
+            patch.added.forEach(function(entry) {
+                agentState.set(entry[0], entry[1]);
+            });
+            patch.moved.forEach(function(entry) {
+                var d = agentState.get(entry[0]);
+                d.x = entry[1];
+                d.y = entry[2];
+            });
+            // Hand out copies, as rendering modifies the data in place
+            return Array.from(agentState.values(), function(d) {
+                return Object.assign({}, d);
+            });
+        };
+
+        // Rebuild a list of portrayals from the column arrays sent by
+        // SVGGrid(columnar=True); null marks a field the portrayal did not define
+        var unpackColumns = function (payload) {
+            var columns = payload.columns;
+            var keys = Object.keys(columns);
+            var data = new Array(payload.n);
+            for (var i = 0; i < payload.n; i++) {
+                var d = {};
+                keys.forEach(function(key) {
+                    var value = columns[key][i];
+                    if (value !== null) {
+                        d[key] = value;
+                    }
+                });
+                data[i] = d;
+            }
+            return data;
+        };
+
+        // Ask the server to only render agents within the given (inclusive)
+        // cell bounds from the next step on; pass null to render the whole grid
+        this.setViewport = function (x0, y0, x1, y1) {
+            var viewport = x0 === null ? null : [x0, y0, x1, y1];
+            send({type: 'set_viewport', index: elements.indexOf(self), viewport: viewport});
+        };
+
+        // Tooltip texts fetched from the server for the current step, by cell
+        var tooltipTexts = new Map();
+        // Cell hovered over while its tooltip text is being fetched
+        var hovered = null;
+
+        // Compute the text to display in the tooltip of cell (x, y) holding the given portrayals
+        var tooltipHtml = function (x, y, portrayals) {
+            var text = 'Cell (' + x + ',' + y + '): ';
+            var ttcount = 0;
+
+            portrayals.forEach(function(d) {
+                if (text == 'Cell (' + x + ',' + y + '): ') {
+                    text += d.text + '[' + d.Layer + ']';
+                    ttcount += 2;
+                } else {
+                    if (ttcount == 4) {
+                        var separator = ',<br />';
+                        ttcount = 0;
+                    } else {
+                    var separator = ', ';
+                    }
+                    text += separator + d.text + '[' + d.Layer + ']';
+                    ttcount += 1;
+                }
+            });
+            return text;
+        };
+
+        // Show the tooltip div and fill it with text
+        var showTooltip = function (text, pageX, pageY) {
+            var tooltip = d3.select('#tooltip');
+            tooltip.transition()
+                .duration(200)
+                .style('opacity', .75)
+                .style('background', 'white')
+                .style('padding-right', '0.5em')
+                .style('padding-left', '0.5em')
+                .style('padding-top', '0.5em')
+                .style('padding-bottom', '0.75em')
+                .style('border', '0.1px black dotted');
+
+            tooltip.html(text)
+                .style('left', (pageX + 10) + 'px')
+                .style('top', (pageY - 25) + 'px')
+                .style('width', 'fit-content')
+                .style('cursor', 'help');
+        };
+
+        this.receiveTooltip = function (msg) {
+            var key = msg.x + ',' + msg.y;
+            tooltipTexts.set(key, msg.data);
+            if (hovered !== null && hovered.key === key) {
+                showTooltip(tooltipHtml(msg.x, msg.y, msg.data), hovered.pageX, hovered.pageY);
+            }
+        };
+
+        // Tell the server this element is done drawing the given frame, so that
+        // it does not drop the next one (see SVGGrid.ack)
+        var sendAck = function (frame) {
+            send({type: 'ack', index: elements.indexOf(self), frame: frame});
+        };
+
+        // Grid state received in a binary frame from SVGGrid(binary=True), drawn
+        // when the viz_state message that follows it arrives
+        var binaryData = [];
+
+        // Decode the frame laid out by SVGGrid.render_binary, preceded by the
+        // element index; typed arrays use the (little-endian) platform byte order
+        this.receiveBinary = function (buffer) {
+            var n = new DataView(buffer).getUint32(4, true);
+            var xs = new Int16Array(buffer, 8, n);
+            var ys = new Int16Array(buffer, 8 + 2 * n, n);
+            var indices = new Uint32Array(buffer, 8 + 4 * n, n);
+            var table = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8 + 8 * n)));
+            binaryData = new Array(n);
+            for (var i = 0; i < n; i++) {
+                binaryData[i] = Object.assign({}, table[indices[i]], {x: xs[i], y: ys[i]});
+            }
+        };
+
+        // Grid state received so far in batches from SVGGrid(stream_batch=...);
+        // each batch is drawn on the next animation frame, and the full state
+        // once the viz_state message that follows the last batch arrives
+        var streamData = [];
+        var streamFrame = null;
+
+        this.renderPartial = function (msg) {
+            if (msg.start === 0) {
+                streamData = [];
+            }
+            Array.prototype.push.apply(streamData, msg.data);
+            if (streamFrame === null) {
+                var element = this;
+                streamFrame = requestAnimationFrame(function() {
+                    streamFrame = null;
+                    element.render(streamData.slice(), true);
+                });
+            }
+        };
+
         this.reset = function () {
+            agentState.clear();
             svg.selectAll('.cell').remove();
         };
 
-        this.render = function (data) {
+        this.render = function (data, partial) {
+            var frame = control.frame;
+
+            // The server skipped this frame because we were falling behind
+            if (data === null) {
+                sendAck(frame);
+                return;
+            }
+
+            // Custom SVG files are fetched asynchronously; acknowledge the frame
+            // only once they have all been drawn
+            var pending = [];
+
+            // Tooltip texts fetched for the previous step may be out of date
+            tooltipTexts.clear();
+
+            if (!Array.isArray(data)) {
+                if (data.binary) {
+                    data = binaryData;
+                } else if (data.stream) {
+                    if (streamFrame !== null) {
+                        cancelAnimationFrame(streamFrame);
+                        streamFrame = null;
+                    }
+                    data = streamData.slice();
+                } else {
+                    data = data.columns ? unpackColumns(data) : applyPatch(data);
+                }
+            }
 
             async function appendSvgToCellMain(cell, imageHref, dx, dy, dr, cell_width, cell_height) {
                 const response = await fetch(imageHref);
@@ -336,7 +525,7 @@ script.onload = function() {
                 if (d.Shape.endsWith('.svg')) {
 
                     // BEGIN ADD MAIN SVG FILE
-                    callAppendSvgToCellMain(cell, 'static/images/' + d.Shape, d.x, d.y, d.r, cell_width, cell_height);
+                    pending.push(callAppendSvgToCellMain(cell, 'static/images/' + d.Shape, d.x, d.y, d.r, cell_width, cell_height));
                     // END ADD MAIN SVG FILE
 
                 } else if (d.Shape === 'square') {
@@ -478,7 +667,7 @@ script.onload = function() {
                 if (d.Shape.endsWith('.svg') && d.Layer < 0) {
 
                     // BEGIN ADD CORNER INFORMATION SVG FILE
-                    callAppendSvgToCellCorner(cell, 'static/images/' + d.Shape, xPos, yPos, size, sizeSVG);
+                    pending.push(callAppendSvgToCellCorner(cell, 'static/images/' + d.Shape, xPos, yPos, size, sizeSVG));
                     // END ADD CORNER INFORMATION SVG FILE
 
                 } else if (d.Shape === 'square' && d.Layer < 0) {
@@ -767,49 +956,21 @@ script.onload = function() {
 
             // Show tooltip when mouseover cell contents
             svg.selectAll('.cell').on('mouseover', function(d) {
-              
-                // Compute the text to display in the tooltip
-                var text = 'Cell (' + d.x + ',' + d.y + '): ';
                 var key = d.x + ',' + d.y;
-                var ttcount = 0;
-
-                tooltipcells[key].forEach(function(d) {
-                    if (text == 'Cell (' + d.x + ',' + d.y + '): ') {
-                        text += d.text + '[' + d.Layer + ']';
-                        ttcount += 2;
-                    } else {
-                        if (ttcount == 4) {
-                            var separator = ',<br />';
-                            ttcount = 0;
-                        } else {
-                        var separator = ', ';
-                        }
-                        text += separator + d.text + '[' + d.Layer + ']';
-                        ttcount += 1;
-                    }
-                });
-
-                // Show the tooltip div and fill it with text
-                var tooltip = d3.select('#tooltip');
-                tooltip.transition()
-                    .duration(200)
-                    .style('opacity', .75)
-                    .style('background', 'white')
-                    .style('padding-right', '0.5em')
-                    .style('padding-left', '0.5em')
-                    .style('padding-top', '0.5em')
-                    .style('padding-bottom', '0.75em')
-                    .style('border', '0.1px black dotted');
-
-                tooltip.html(text)
-                    .style('left', (d3.event.pageX + 10) + 'px')
-                    .style('top', (d3.event.pageY - 25) + 'px')
-                    .style('width', 'fit-content')
-                    .style('cursor', 'help');
+                if (!lazyText) {
+                    showTooltip(tooltipHtml(d.x, d.y, tooltipcells[key]), d3.event.pageX, d3.event.pageY);
+                } else if (tooltipTexts.has(key)) {
+                    showTooltip(tooltipHtml(d.x, d.y, tooltipTexts.get(key)), d3.event.pageX, d3.event.pageY);
+                } else {
+                    // Shown by receiveTooltip once the server answers
+                    hovered = {key: key, pageX: d3.event.pageX, pageY: d3.event.pageY};
+                    send({type: 'get_tooltip', index: elements.indexOf(self), x: d.x, y: d.y});
+                }
             })
 
             // Hide tooltip when mouseout cell contents
             .on('mouseout', function(d) {
+                hovered = null;
 
                 // Hide the tooltip div
                 d3.select('#tooltip').transition()
@@ -818,9 +979,20 @@ script.onload = function() {
             });
             // END TOOLTIP
             
-            // Remove SVG elements that are not in the data received from the server
-            cells.exit().remove();
-            textCells.exit().remove();
+            // The batches of a streamed step only add and update cells, so that the
+            // cells of the previous step stay on screen until the complete state
+            // has been drawn; it is then acknowledged as a whole
+            if (!partial) {
+                // Remove SVG elements that are not in the data received from the server
+                cells.exit().remove();
+                textCells.exit().remove();
+
+                // Acknowledge even if a shape failed to load, so that the server
+                // does not keep skipping frames for the rest of the run
+                Promise.allSettled(pending).then(function() {
+                    sendAck(frame);
+                });
+            }
 
             // Function to download SVG
             document.querySelector('svg').addEventListener('click', function(event) {
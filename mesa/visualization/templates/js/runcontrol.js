@@ -28,6 +28,9 @@ function ModelController(tick = 0, fps = 3, running = false, finished = false) {
   this.fps = fps;
   this.running = running;
   this.finished = finished;
+  // Number of the last viz_state message received, which elements echo back
+  // to the server once they have drawn it
+  this.frame = 0;
 
   /** Start the model and keep it running until stopped */
   this.start = function start() {
@@ -135,17 +138,34 @@ const ws = new WebSocket(
     "/ws"
 );
 
+ws.binaryType = "arraybuffer";
+
 /**
  * Parse and handle an incoming message on the WebSocket connection.
- * @param {string} message - the message received from the WebSocket
+ * Binary messages start with the index of the element they are meant for.
+ * @param {string|ArrayBuffer} message - the message received from the WebSocket
  */
 ws.onmessage = function (message) {
+  if (message.data instanceof ArrayBuffer) {
+    const index = new DataView(message.data).getUint32(0, true);
+    vizElements[index].receiveBinary(message.data);
+    return;
+  }
   const msg = JSON.parse(message.data);
   switch (msg["type"]) {
     case "viz_state":
       // Update visualization state
+      controller.frame = msg["frame"];
       controller.render(msg["data"]);
       break;
+    case "grid_state_partial":
+      // One batch of the state of a streaming visualization element
+      vizElements[msg["index"]].renderPartial(msg);
+      break;
+    case "tooltip":
+      // Text for the tooltip of a cell, requested by a visualization element
+      vizElements[msg["index"]].receiveTooltip(msg);
+      break;
     case "end":
       // We have reached the end of the model
       controller.done();
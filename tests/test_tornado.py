@@ -1,10 +1,16 @@
 import json
+import struct
 
 import tornado
 from tornado.testing import AsyncHTTPTestCase
 
 from mesa import Model
-from mesa.visualization.ModularVisualization import ModularServer
+from mesa.visualization.ModularVisualization import (
+    ModularServer,
+    VisualizationElement,
+)
+from mesa.visualization.modules.SVGGridVisualization import SVGGrid
+from tests.test_visualization import MockModel
 
 
 class TestServer(AsyncHTTPTestCase):
@@ -39,3 +45,146 @@ class TestServer(AsyncHTTPTestCase):
         ws_client.write_message("Unknown message!")
         response = yield ws_client.read_message()
         assert response is None
+
+    @tornado.testing.gen_test
+    def test_websocket_compression(self):
+        ws_url = "ws://localhost:" + str(self.get_http_port()) + "/ws"
+        ws_client = yield tornado.websocket.websocket_connect(
+            ws_url, compression_options={}
+        )
+        extensions = ws_client.headers.get("Sec-WebSocket-Extensions", "")
+        assert "permessage-deflate" in extensions
+        response = yield ws_client.read_message()
+        assert json.loads(response)["type"] == "model_params"
+
+
+class FilmElement(VisualizationElement):
+    """An element whose attributes share their names with the server protocol."""
+
+    def __init__(self):
+        self.frame = "reel"
+        self.binary = True
+        self.viewport = "wide"
+
+    def render(self, model):
+        return self.frame
+
+
+class TestPlainElement(AsyncHTTPTestCase):
+    def get_app(self):
+        self.element = FilmElement()
+        return ModularServer(Model, [self.element])
+
+    @tornado.testing.gen_test
+    def test_attributes_left_alone(self):
+        ws_url = "ws://localhost:" + str(self.get_http_port()) + "/ws"
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        yield ws_client.read_message()
+
+        ws_client.write_message('{"type": "reset"}')
+        response = yield ws_client.read_message()
+        msg = json.loads(response)
+        assert msg == {"type": "viz_state", "frame": 1, "data": ["reel"]}
+
+        ws_client.write_message(
+            '{"type": "set_viewport", "index": 0, "viewport": [0, 0, 1, 1]}'
+        )
+        ws_client.write_message('{"type": "get_step"}')
+        response = yield ws_client.read_message()
+        assert json.loads(response)["data"] == ["reel"]
+        assert self.element.viewport == "wide"
+
+
+class DoubleStepModel(MockModel):
+    def step(self):
+        self.schedule.step()
+        self.schedule.step()
+
+
+class TestFrameDropping(AsyncHTTPTestCase):
+    def get_app(self):
+        def portrayal(agent):
+            return {"Shape": "circle", "r": 0.5, "Layer": 0, "Color": "red"}
+
+        grid = SVGGrid(portrayal, 2, 2)
+        return ModularServer(
+            DoubleStepModel, [grid], model_params={"width": 2, "height": 2}
+        )
+
+    @tornado.testing.gen_test
+    def test_frames_sent_while_client_keeps_up(self):
+        ws_url = "ws://localhost:" + str(self.get_http_port()) + "/ws"
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        yield ws_client.read_message()
+
+        ws_client.write_message('{"type": "reset"}')
+        for frame in range(1, 5):
+            response = yield ws_client.read_message()
+            msg = json.loads(response)
+            assert msg["frame"] == frame
+            assert len(msg["data"][0]) == 4
+            ws_client.write_message(
+                json.dumps({"type": "ack", "index": 0, "frame": frame})
+            )
+            ws_client.write_message('{"type": "get_step"}')
+
+
+class TestBinaryServer(AsyncHTTPTestCase):
+    def get_app(self):
+        def portrayal(agent):
+            return {"Shape": "circle", "r": 0.5, "Layer": 0, "Color": "red"}
+
+        grid = SVGGrid(portrayal, 2, 2, binary=True)
+        return ModularServer(MockModel, [grid], model_params={"width": 2, "height": 2})
+
+    @tornado.testing.gen_test
+    def test_binary_frame(self):
+        ws_url = "ws://localhost:" + str(self.get_http_port()) + "/ws"
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        yield ws_client.read_message()
+
+        ws_client.write_message('{"type": "reset"}')
+        response = yield ws_client.read_message()
+        assert isinstance(response, bytes)
+        assert struct.unpack_from("<II", response) == (0, 4)
+        response = yield ws_client.read_message()
+        msg = json.loads(response)
+        assert msg == {"type": "viz_state", "frame": 1, "data": [{"binary": True}]}
+
+        ws_client.write_message('{"type": "get_tooltip", "index": 0, "x": 1, "y": 0}')
+        response = yield ws_client.read_message()
+        msg = json.loads(response)
+        assert msg == {
+            "type": "tooltip",
+            "index": 0,
+            "x": 1,
+            "y": 0,
+            "data": [{"Layer": 0}],
+        }
+
+
+class TestStreamServer(AsyncHTTPTestCase):
+    def get_app(self):
+        def portrayal(agent):
+            return {"Shape": "circle", "r": 0.5, "Layer": 0, "Color": "red"}
+
+        grid = SVGGrid(portrayal, 2, 2, stream_batch=3)
+        return ModularServer(MockModel, [grid], model_params={"width": 2, "height": 2})
+
+    @tornado.testing.gen_test
+    def test_stream_batches(self):
+        ws_url = "ws://localhost:" + str(self.get_http_port()) + "/ws"
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        yield ws_client.read_message()
+
+        ws_client.write_message('{"type": "reset"}')
+        batches = []
+        for _ in range(2):
+            response = yield ws_client.read_message()
+            batches.append(json.loads(response))
+        assert [msg["type"] for msg in batches] == ["grid_state_partial"] * 2
+        assert [(msg["start"], msg["end"]) for msg in batches] == [(0, 3), (3, 4)]
+        assert [msg["done"] for msg in batches] == [False, True]
+        response = yield ws_client.read_message()
+        msg = json.loads(response)
+        assert msg == {"type": "viz_state", "frame": 1, "data": [{"stream": True}]}
@@ -1,3 +1,7 @@
+import asyncio
+import json
+import struct
+import sys
 from collections import defaultdict
 from unittest import TestCase
 
@@ -6,6 +10,12 @@ from mesa.space import MultiGrid
 from mesa.time import SimultaneousActivation
 from mesa.visualization.ModularVisualization import ModularServer
 from mesa.visualization.modules import CanvasGrid, TextElement
+from mesa.visualization.modules.SVGGridVisualization import (
+    SVGGrid,
+    SVGGridCanvas,
+    _round_portrayal,
+    _specialize_round_portrayal,
+)
 from mesa.visualization.UserParam import UserSettableParameter
 from tests.test_batchrunner import MockAgent
 
@@ -76,6 +86,11 @@ class TestModularServer(TestCase):
         state = self.server.render_model()
         assert state[1] == "<b>VisualizationElement goes here</b>."
 
+    def test_render_model_json(self):
+        state = json.loads(self.server.render_model_json())
+        assert state[0] == {"0": [self.portrayal(None)]}
+        assert state[1] == "<b>VisualizationElement goes here</b>."
+
     def test_user_params(self):
         print(self.server.user_params)
         assert self.server.user_params == {
@@ -84,3 +99,349 @@ class TestModularServer(TestCase):
                 "slider", "Test Parameter", 200, 0, 300, 10
             ).json,
         }
+
+
+def records(state):
+    """Flatten the (x, y, portrayal) tuples of SVGGrid.render as in its JSON."""
+    return [dict(portrayal, x=x, y=y) for x, y, portrayal in state]
+
+
+class TestSVGGrid(TestCase):
+    """Test the SVGGrid visualization element"""
+
+    def portrayal(self, agent):
+        self.calls += 1
+        return {"Shape": "circle", "r": 0.5, "Layer": 0, "Color": "red"}
+
+    def setUp(self):
+        self.calls = 0
+        self.model = MockModel(3, 2)
+        self.grid = SVGGrid(self.portrayal, 3, 2, 30, 20)
+
+    def test_render(self):
+        state = self.grid.render(self.model)
+        assert len(state) == 6
+        assert self.calls == 6
+        assert {(x, y) for x, y, _ in state} == {
+            (x, y) for x in range(3) for y in range(2)
+        }
+
+    def test_portrayal_cache(self):
+        agent = self.model.schedule.agents[0]
+        agent._portrayal_version = 0
+        self.grid.render(self.model)
+        self.grid.render(self.model)
+        assert self.calls == 11
+
+        agent._portrayal_version += 1
+        self.grid.render(self.model)
+        assert self.calls == 17
+
+        self.model.grid.move_agent(agent, (2, 1))
+        state = self.grid.render(self.model)
+        assert self.calls == 22
+        assert [(x, y) for x, y, _ in state].count((2, 1)) == 2
+
+        self.grid.invalidate(agent)
+        self.grid.render(self.model)
+        assert self.calls == 28
+
+    def test_portrayal_cache_checks_agent(self):
+        agent = self.model.schedule.agents[0]
+        agent._portrayal_version = 0
+        self.grid.render(self.model)
+        # Pretend the entry was made for a removed agent whose id was reused.
+        _, version, portrayal = self.grid._portrayal_cache[id(agent)]
+        self.grid._portrayal_cache[id(agent)] = (object(), version, portrayal)
+        self.grid.render(self.model)
+        assert self.calls == 12
+
+    def test_render_json(self):
+        agent = self.model.schedule.agents[0]
+        agent._portrayal_version = 0
+        state = json.loads(self.grid.render_json(self.model))
+        assert state == records(self.grid.render(self.model))
+
+        (fragment,) = (v[1] for v in self.grid._fragment_cache.values())
+        self.model.grid.move_agent(agent, (2, 1))
+        state = json.loads(self.grid.render_json(self.model))
+        assert next(iter(self.grid._fragment_cache.values()))[1] is fragment
+        assert state == records(self.grid.render(self.model))
+
+    def test_portrayal_not_modified(self):
+        portrayal = {"Shape": "circle", "r": 0.5, "Layer": 0}
+        self.grid.portrayal_method = lambda agent: portrayal
+        state = self.grid.render(self.model)
+        assert "x" not in portrayal
+        assert len({(x, y) for x, y, _ in state}) == 6
+
+    def test_render_json_rounds_floats(self):
+        portrayal = {"Shape": "circle", "r": 1 / 3, "Color": "rgb(178.4, 34, 34)"}
+        self.grid.portrayal_method = lambda agent: portrayal
+        state = json.loads(self.grid.render_json(self.model))
+        assert state[0]["r"] == 0.33
+        assert state[0]["Color"] == "rgb(178,34,34)"
+        assert portrayal["r"] == 1 / 3
+
+    def test_render_diff(self):
+        self.grid.diff = True
+        patch = self.grid.render(self.model)
+        assert patch["full_refresh"]
+        assert len(patch["added"]) == 6
+        assert patch["removed"] == patch["moved"] == []
+
+        patch = self.grid.render(self.model)
+        assert not patch["full_refresh"]
+        assert patch["added"] == patch["removed"] == patch["moved"] == []
+
+        agent = self.model.schedule.agents[0]
+        self.model.grid.move_agent(agent, (2, 1))
+        patch = self.grid.render(self.model)
+        assert patch["moved"] == [[id(agent), 2, 1]]
+
+        self.model.schedule.remove(agent)
+        patch = self.grid.render(self.model)
+        assert patch["removed"] == [id(agent)]
+
+        patch = json.loads(self.grid.render_json(MockModel(3, 2)))
+        assert patch["full_refresh"]
+        assert len(patch["added"]) == 6
+
+    def test_render_columns(self):
+        grid = SVGGrid(self.portrayal, 3, 2, 30, 20, columnar=True)
+        payload = grid.render(self.model)
+        columns = payload["columns"]
+        assert payload["n"] == 6
+        assert columns["Shape"] == ["circle"] * 6
+        assert columns["r"] == [0.5] * 6
+        rows = [{k: column[i] for k, column in columns.items()} for i in range(6)]
+        assert rows == records(SVGGrid(self.portrayal, 3, 2).render(self.model))
+        assert json.loads(grid.render_json(self.model)) == payload
+
+        for layer in (0.5, 40000):
+            grid.portrayal_method = lambda agent, layer=layer: {"Layer": layer}
+            payload = json.loads(grid.render_json(self.model))
+            assert payload["columns"]["Layer"] == [layer] * 6
+
+        with self.assertRaises(ValueError):
+            SVGGrid(self.portrayal, 3, 2, diff=True, columnar=True)
+
+    def test_render_viewport(self):
+        state = self.grid.render(self.model, viewport=(1, 0, 2, 0))
+        assert self.calls == 2
+        assert sorted((x, y) for x, y, _ in state) == [(1, 0), (2, 0)]
+
+        self.grid.viewport = (0, 1, 0, 1)
+        state = self.grid.render(self.model)
+        assert [(x, y) for x, y, _ in state] == [(0, 1)]
+
+    def test_render_parallel(self):
+        portrayed = []
+
+        def portrayal(agent):
+            portrayed.append(agent)
+            return {"Shape": "circle", "r": 0.5, "Layer": 0, "Color": "red"}
+
+        grid = SVGGrid(portrayal, 3, 2, 30, 20, parallel=True)
+        agent = self.model.schedule.agents[0]
+        agent._portrayal_version = 0
+        assert grid.render(self.model) == self.grid.render(self.model)
+        assert len(portrayed) == 6
+        grid.render(self.model)
+        assert len(portrayed) == 11
+        assert agent not in portrayed[6:]
+
+    def test_render_drops_frames_while_client_lags(self):
+        self.grid.ack(0)
+        self.grid.frame = 1
+        assert self.grid.render(self.model) is not None
+        self.grid.frame = 2
+        assert self.grid.render(self.model) is None
+        assert self.grid.render_json(self.model) == "null"
+
+        self.model.running = False
+        assert self.grid.render(self.model) is not None
+        self.model.running = True
+        self.grid.ack(2)
+        assert self.grid.render(self.model) is not None
+
+    def test_render_interns_strings(self):
+        red = 255
+        self.grid.portrayal_method = lambda agent: {
+            "Shape": "".join(["cir", "cle"]),
+            "Color": f"rgb({red}, 0, 0)",
+        }
+        (_, _, first), (_, _, second) = self.grid.render(self.model)[:2]
+        assert first["Shape"] is second["Shape"] is sys.intern("circle")
+        assert first["Color"] is second["Color"]
+        assert first["Color"] == "rgb(255,0,0)"
+
+    def test_render_skipped_when_unchanged(self):
+        for agent in self.model.schedule.agents:
+            agent._portrayal_version = 0
+        state = self.grid.render(self.model)
+        assert self.grid.render(self.model) is state
+        assert self.grid.render_json(self.model) is self.grid.render_json(self.model)
+
+        agent = self.model.schedule.agents[0]
+        self.model.grid.move_agent(agent, (2, 1))
+        assert self.grid.render(self.model) is not state
+
+        # Replace the last agent by a new one in the same cell, at the same version.
+        state = self.grid.render(self.model)
+        agent = self.model.schedule.agents[-1]
+        pos = agent.pos
+        self.model.schedule.remove(agent)
+        self.model.grid.remove_agent(agent)
+        newcomer = MockAgent(999, self.model, 0)
+        newcomer._portrayal_version = 0
+        self.model.grid.place_agent(newcomer, pos)
+        self.model.schedule.add(newcomer)
+        assert self.grid.render(self.model) is not state
+
+        grid = SVGGrid(self.portrayal, 3, 2, 30, 20, diff=True)
+        assert grid.render(self.model)["full_refresh"]
+        assert grid.render(self.model) == {
+            "full_refresh": False,
+            "added": [],
+            "removed": [],
+            "moved": [],
+        }
+
+    def test_render_binary(self):
+        grid = SVGGrid(self.portrayal, 3, 2, 30, 20, binary=True)
+        payload = grid.render_binary(self.model)
+        (n,) = struct.unpack_from("<I", payload)
+        xs = struct.unpack_from(f"<{n}h", payload, 4)
+        ys = struct.unpack_from(f"<{n}h", payload, 4 + 2 * n)
+        indices = struct.unpack_from(f"<{n}I", payload, 4 + 4 * n)
+        table = json.loads(payload[4 + 8 * n :])
+        decoded = [dict(table[i], x=x, y=y) for x, y, i in zip(xs, ys, indices)]
+        assert decoded == records(self.grid.render(self.model))
+        assert len(table) == 1
+        assert grid.render_json(self.model) == '{"binary":true}'
+
+        with self.assertRaises(ValueError):
+            SVGGrid(self.portrayal, 40000, 2, binary=True)
+
+    def test_portrayal_dirty_flag(self):
+        agent = self.model.schedule.agents[0]
+        agent._portrayal_dirty = True
+        self.grid.render(self.model)
+        assert self.calls == 6
+        assert agent._portrayal_dirty is False
+        self.grid.render(self.model)
+        assert self.calls == 11
+
+        agent._portrayal_dirty = True
+        self.grid.render(self.model)
+        assert self.calls == 17
+
+    def test_portrayal_dirty_flag_with_version(self):
+        color = {"value": "red"}
+        self.grid.portrayal_method = lambda agent: {
+            "Shape": "circle",
+            "Color": color["value"],
+        }
+        for agent in self.model.schedule.agents:
+            agent._portrayal_version = 0
+        agent = self.model.schedule.agents[0]
+        agent._portrayal_dirty = False
+        assert self.grid.render(self.model)[0][2]["Color"] == "red"
+        json.loads(self.grid.render_json(self.model))
+
+        color["value"] = "blue"
+        agent._portrayal_dirty = True
+        assert self.grid.render(self.model)[0][2]["Color"] == "blue"
+        agent._portrayal_dirty = True
+        assert json.loads(self.grid.render_json(self.model))[0]["Color"] == "blue"
+
+    def test_portrayal_dirty_flag_shared_by_grids(self):
+        color = {"value": "red"}
+
+        def portrayal(agent):
+            return {"Shape": "circle", "Color": color["value"]}
+
+        grids = [SVGGrid(portrayal, 3, 2, 30, 20) for _ in range(2)]
+        for agent in self.model.schedule.agents:
+            agent._portrayal_version = 0
+            agent._portrayal_dirty = False
+        for grid in grids:
+            assert grid.render(self.model)[0][2]["Color"] == "red"
+
+        color["value"] = "blue"
+        self.model.schedule.agents[0]._portrayal_dirty = True
+        for grid in grids:
+            assert grid.render(self.model)[0][2]["Color"] == "blue"
+
+    def test_render_stream(self):
+        grid = SVGGrid(self.portrayal, 3, 2, 30, 20, stream_batch=4)
+
+        async def collect():
+            return [batch async for batch in grid.render_stream(self.model)]
+
+        batches = asyncio.run(collect())
+        assert [start for start, _ in batches] == [0, 4]
+        assert [len(records) for _, records in batches] == [4, 2]
+        streamed = [record for _, records in batches for record in records]
+        assert streamed == records(self.grid.render(self.model))
+        assert grid.render_json(self.model) == '{"stream":true}'
+
+    def test_render_lazy_text(self):
+        def portrayal(agent):
+            portrayal = {"Shape": "circle", "r": 0.5, "Layer": 0, "Color": "red"}
+            return dict(portrayal, text=agent.unique_id, text_color="white")
+
+        grid = SVGGrid(portrayal, 3, 2, 30, 20, lazy_text=True)
+        state = self.grid.render(self.model)
+        assert grid.render(self.model) == state
+        assert json.loads(grid.render_json(self.model)) == records(state)
+        assert "lazyText: true" in grid.js_code
+
+        agent = self.model.grid.get_cell_list_contents([(2, 1)])[0]
+        assert grid.get_tooltip(self.model, 2, 1) == [
+            {"Layer": 0, "text": agent.unique_id, "text_color": "white"}
+        ]
+
+    def test_specialized_round_portrayal(self):
+        portrayal = {
+            "Shape": "circle",
+            "r": 0.123,
+            "Layer": 0,
+            "Color": "rgb(1.2, 2, 3)",
+        }
+        round_portrayal = _specialize_round_portrayal(
+            [portrayal, dict(portrayal, r=0.5)]
+        )
+        assert round_portrayal is not _round_portrayal
+        for other in (
+            portrayal,
+            dict(portrayal, r=0.5, Color="red"),
+            dict(portrayal, scale=0.456),
+            {"Shape": "circle", "Layer": 0},
+            dict(portrayal, Color=["unhashable"]),
+        ):
+            assert round_portrayal(other) == _round_portrayal(other)
+        assert round_portrayal(portrayal) == dict(portrayal, r=0.12, Color="rgb(1,2,3)")
+
+        assert (
+            _specialize_round_portrayal([portrayal, {"Shape": "circle"}])
+            is _round_portrayal
+        )
+
+    def test_render_canvas(self):
+        state = self.grid.render(self.model)
+        grid = SVGGridCanvas(self.portrayal, 3, 2, 30, 20, threshold=6)
+        assert grid.render(self.model) == {"mode": "svg", "data": state}
+        assert json.loads(grid.render_json(self.model)) == {
+            "mode": "svg",
+            "data": records(state),
+        }
+
+        grid.threshold = 5
+        grid.invalidate(self.model.schedule.agents[0])
+        assert grid.render(self.model) == {"mode": "canvas", "data": state}
+        assert json.loads(grid.render_json(self.model)) == {
+            "mode": "canvas",
+            "data": records(state),
+        }